@@ -3,53 +3,80 @@
 loader.py — Resilient ETL client for the Animals API.
 
 Requirements satisfied:
-- Retries on 500/502/503/504 with exponential backoff + jitter
+- Retries on 408/429/500/502/503/504 with decorrelated-jitter exponential
+  backoff, honouring Retry-After when the server sends one
 - Generous timeouts (>= 30s) so slow requests don't crash
-- Consistent flow: fetch all -> transform -> post in batches (<=100)
-- Bounded concurrency for detail fetches
+- Pipelined flow: fetch -> transform -> post in batches (<=100) as details arrive
+- Bounded concurrency for list-page and detail fetches
+- Circuit breaker pauses all requests briefly after a burst of 5xx/timeouts
 """
 import asyncio
 import argparse
 import os
+import random
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Dict, List, Optional
 
 import httpx
+import orjson
 
 
-RETRY_STATUS = {500, 502, 503, 504}
+# 408/429 are the only 4xx worth retrying; everything else is a caller error
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+# >= 30s read timeout to tolerate 5–15s chaos delays
+DEFAULT_TIMEOUT = httpx.Timeout(45.0, connect=5.0)
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+_UTC = timezone.utc
+JSON_HEADERS = {"content-type": "application/json"}
 
 
-def chunks(seq: List[Any], size: int) -> Iterable[List[Any]]:
-    for i in range(0, len(seq), size):
-        yield seq[i : i + size]
+def backoff_delay(
+    prev: Optional[float] = None,
+    base: float = BACKOFF_BASE,
+    cap: float = BACKOFF_CAP,
+) -> float:
+    # Decorrelated jitter: spread concurrent retries apart instead of in lockstep
+    if prev is None:
+        prev = base
+    return min(cap, random.uniform(base, prev * 3))
 
 
 def to_iso8601_utc(ms: Optional[Any]) -> Optional[str]:
-    if ms in (None, "", 0):
+    if not ms:
         return None
     try:
-        # Convert string to int if necessary
+        # Convert string to int if necessary; int() still rejects digit-like
+        # characters such as "²" that pass isdigit()
         if isinstance(ms, str):
             if not ms.strip().isdigit():
                 return None
             ms = int(ms)
-        return (
-            datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
-            .isoformat()
-            .replace("+00:00", "Z")
-        )
-    except Exception:
+        if isinstance(ms, float):
+            # Keep sub-millisecond precision for float inputs
+            dt = datetime.fromtimestamp(ms / 1000, _UTC)
+            micros = dt.microsecond
+        else:
+            seconds, millis = divmod(int(ms), 1000)
+            dt = datetime.fromtimestamp(seconds, _UTC)
+            micros = millis * 1000
+    except (TypeError, ValueError, OverflowError, OSError):
         return None
+    # Same shape as isoformat(): zero-padded year, microseconds only when
+    # non-zero, "Z" suffix
+    stamp = (
+        f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
+        f"T{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
+    )
+    return f"{stamp}.{micros:06d}Z" if micros else f"{stamp}Z"
 
 
 def transform(detail: Dict[str, Any]) -> Dict[str, Any]:
-    friends_value = detail.get("friends", [])
-    if isinstance(friends_value, str):
-        friends = [f for f in friends_value.split(",") if f]
-    elif isinstance(friends_value, list):
-        friends = friends_value
-    else:
+    friends = detail.get("friends")
+    if isinstance(friends, str):
+        friends = [f for f in friends.split(",") if f] if friends else []
+    elif not isinstance(friends, list):
         friends = []
 
     return {
@@ -60,34 +87,105 @@ def transform(detail: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-async def get_json(
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    # Only the delta-seconds form is honoured; HTTP-dates fall back to backoff
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return min(BACKOFF_CAP, max(0.0, float(value)))
+    except ValueError:
+        return None
+
+
+# Circuit breaker shared by all requests of a run: ``threshold`` 5xx/timeouts
+# within ``window`` seconds pause every request for a jittered 1-3s
+class CircuitBreaker:
+    def __init__(self, threshold: int = 10, window: float = 5.0) -> None:
+        self.threshold = threshold
+        self.window = window
+        self.open_until = 0.0
+        self.failures = 0
+        self.window_start = 0.0
+
+    def record_failure(self) -> None:
+        now = time.monotonic()
+        if now - self.window_start > self.window:
+            self.window_start = now
+            self.failures = 0
+        self.failures += 1
+        if self.failures >= self.threshold:
+            # Trip: hold every caller so the server can recover
+            self.open_until = now + random.uniform(1.0, 3.0)
+            self.failures = 0
+
+    def record_success(self) -> None:
+        self.failures = 0
+
+    async def wait(self) -> None:
+        # Waiting here does not consume a retry attempt
+        while time.monotonic() < self.open_until:
+            await asyncio.sleep(random.uniform(0.1, 0.5))
+
+
+async def request_with_retries(
     client: httpx.AsyncClient,
+    method: str,
     url: str,
     *,
-    params: Dict[str, Any] | None = None,
     max_retries: int = 6,
-    connect_timeout: float = 5.0,
-    read_timeout: float = 45.0,  # >= 30s to tolerate 5–15s chaos delays
-) -> Dict[str, Any]:
+    breaker: Optional[CircuitBreaker] = None,
+    **kwargs: Any,
+) -> httpx.Response:
     attempt = 0
+    delay: Optional[float] = None
     while True:
         attempt += 1
+        if breaker is not None:
+            await breaker.wait()
         try:
-            r = await client.get(
-                url,
-                params=params,
-                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
-            )
-            if r.status_code in RETRY_STATUS:
-                raise httpx.HTTPStatusError("retryable", request=r.request, response=r)
-            r.raise_for_status()
-            return r.json()
-        except (httpx.TimeoutException, httpx.HTTPStatusError) as e:
+            r = await client.request(method, url, **kwargs)
+        except httpx.TimeoutException:
+            if breaker is not None:
+                breaker.record_failure()
             if attempt >= max_retries:
                 raise
-            # Exponential backoff with a little deterministic jitter
-            backoff = min(30, (2**attempt)) + (attempt * 0.137)
-            await asyncio.sleep(backoff)
+            delay = backoff_delay(delay)
+            await asyncio.sleep(delay)
+            continue
+
+        if breaker is not None:
+            if r.status_code >= 500:
+                breaker.record_failure()
+            elif r.is_success:
+                breaker.record_success()
+        if r.status_code in RETRY_STATUS and attempt < max_retries:
+            delay = backoff_delay(delay)
+            wait = retry_after_seconds(r)
+            await asyncio.sleep(delay if wait is None else wait)
+            continue
+        # Non-transient 4xx (and exhausted retries) fail immediately
+        r.raise_for_status()
+        return r
+
+
+async def get_json(
+    client: httpx.AsyncClient,
+    url: str,
+    *,
+    params: Dict[str, Any] | None = None,
+    max_retries: int = 6,
+    breaker: Optional[CircuitBreaker] = None,
+) -> Dict[str, Any]:
+    r = await request_with_retries(
+        client,
+        "GET",
+        url,
+        params=params,
+        max_retries=max_retries,
+        breaker=breaker,
+    )
+    return orjson.loads(r.content)
 
 
 async def post_json(
@@ -96,40 +194,63 @@ async def post_json(
     payload: Any,
     *,
     max_retries: int = 6,
-    connect_timeout: float = 5.0,
-    read_timeout: float = 45.0,
+    breaker: Optional[CircuitBreaker] = None,
 ) -> Dict[str, Any]:
-    attempt = 0
-    while True:
-        attempt += 1
-        try:
-            r = await client.post(
-                url,
-                json=payload,
-                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
-            )
-            if r.status_code in RETRY_STATUS:
-                raise httpx.HTTPStatusError("retryable", request=r.request, response=r)
-            r.raise_for_status()
-            return r.json()
-        except (httpx.TimeoutException, httpx.HTTPStatusError):
-            if attempt >= max_retries:
-                raise
-            backoff = min(30, (2**attempt)) + (attempt * 0.137)
-            await asyncio.sleep(backoff)
+    r = await request_with_retries(
+        client,
+        "POST",
+        url,
+        content=orjson.dumps(payload),
+        headers=JSON_HEADERS,
+        max_retries=max_retries,
+        breaker=breaker,
+    )
+    return orjson.loads(r.content)
 
 
-async def fetch_all_ids(client: httpx.AsyncClient, list_url: str) -> List[int]:
+async def fetch_bulk_ids(
+    client: httpx.AsyncClient,
+    bulk_url: str,
+    breaker: Optional[CircuitBreaker] = None,
+) -> Optional[List[int]]:
+    # One NDJSON request instead of paging; None means the API doesn't offer it
+    try:
+        r = await request_with_retries(client, "GET", bulk_url, breaker=breaker)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == httpx.codes.NOT_FOUND:
+            return None
+        raise
+    return [orjson.loads(line)["id"] for line in r.content.splitlines() if line]
+
+
+async def fetch_all_ids(
+    client: httpx.AsyncClient,
+    list_url: str,
+    sem: Optional[asyncio.Semaphore] = None,
+    group_size: int = 200,
+    breaker: Optional[CircuitBreaker] = None,
+) -> List[int]:
     # Fetch first page to get total_pages
-    first = await get_json(client, list_url, params={"page": 1})
+    first = await get_json(client, list_url, params={"page": 1}, breaker=breaker)
     total_pages = int(first["total_pages"])
-    ids = [item["id"] for item in first["items"]]
+    if sem is None:
+        sem = asyncio.Semaphore(32)
+
+    async def fetch_page(page: int) -> Dict[str, Any]:
+        async with sem:
+            return await get_json(
+                client, list_url, params={"page": page}, breaker=breaker
+            )
+
+    # Remaining pages concurrently; results are indexed by page to keep ordering
+    pages: Dict[int, Dict[str, Any]] = {1: first}
+    remaining = list(range(2, total_pages + 1))
+    for i in range(0, len(remaining), group_size):
+        group = remaining[i : i + group_size]
+        results = await asyncio.gather(*(fetch_page(page) for page in group))
+        pages.update(zip(group, results))
 
-    # Remaining pages
-    for page in range(2, total_pages + 1):
-        data = await get_json(client, list_url, params={"page": page})
-        ids.extend(item["id"] for item in data["items"])
-    return ids
+    return [item["id"] for page in sorted(pages) for item in pages[page]["items"]]
 
 
 async def fetch_detail(
@@ -137,44 +258,113 @@ async def fetch_detail(
     detail_url_tmpl: str,
     animal_id: int,
     sem: asyncio.Semaphore,
+    breaker: Optional[CircuitBreaker] = None,
 ) -> Dict[str, Any]:
     async with sem:
-        detail = await get_json(client, detail_url_tmpl.format(id=animal_id))
+        detail = await get_json(
+            client, detail_url_tmpl.format(id=animal_id), breaker=breaker
+        )
         return transform(detail)
 
 
-async def run(base_url: str, concurrency: int = 32, batch_size: int = 100):
-    list_url = f"{base_url}/animals/v1/animals"
-    detail_url = f"{base_url}/animals/v1/animals/{{id}}"
-    home_url = f"{base_url}/animals/v1/home"
+async def run(
+    base_url: str,
+    concurrency: int = 32,
+    batch_size: int = 100,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+):
+    # Relative to the client's base_url
+    list_url = "/animals/v1/animals"
+    bulk_url = "/animals/v1/animals.ndjson"
+    detail_url = "/animals/v1/animals/{id}"
+    home_url = "/animals/v1/home"
 
     sem = asyncio.Semaphore(concurrency)
+    # Fresh per run so no failure state leaks between runs
+    breaker = CircuitBreaker()
+    if transport is None:
+        # One pooled transport for the whole run; retries are handled above it.
+        # The pool is sized above the semaphore so no task waits on a connection.
+        pool_size = max(100, concurrency * 2)
+        transport = httpx.AsyncHTTPTransport(
+            retries=0,
+            # HTTP/2 is only negotiated over TLS (ALPN), so it applies to https
+            # base URLs; plain http://api:3123 stays on pooled HTTP/1.1
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=60,
+            ),
+        )
 
-    async with httpx.AsyncClient() as client:
-        print(f"Listing animals from {list_url} …")
-        ids = await fetch_all_ids(client, list_url)
+    async with httpx.AsyncClient(
+        base_url=base_url, transport=transport, timeout=DEFAULT_TIMEOUT
+    ) as client:
+        print(f"Listing animals from {base_url}{bulk_url} …")
+        ids = await fetch_bulk_ids(client, bulk_url, breaker)
+        if ids is None:
+            print(f"Bulk listing unavailable, paging {base_url}{list_url} …")
+            ids = await fetch_all_ids(client, list_url, sem, breaker=breaker)
         total = len(ids)
         print(f"Total animals detected: {total}")
 
-        print(f"Fetching details concurrently (concurrency={concurrency}) …")
-        details: List[Dict[str, Any]] = []
-        # Process in manageable groups to avoid gigantic gather lists
-        group_size = 5000
-        for i in range(0, total, group_size):
-            group = ids[i : i + group_size]
-            details.extend(
-                await asyncio.gather(
-                    *(fetch_detail(client, detail_url, _id, sem) for _id in group)
-                )
-            )
-            print(f"Fetched {len(details)}/{total} details")
+        print(
+            f"Fetching details (concurrency={concurrency}) and posting to "
+            f"{base_url}{home_url} in batches of {batch_size} …"
+        )
+        # Transformed details flow through a bounded queue so POSTs overlap the
+        # remaining GETs. A fixed pool of fetch workers blocks on a full queue,
+        # so GETs are throttled and only a few batches are held in memory
+        queue: asyncio.Queue[Optional[Dict[str, Any]]] = asyncio.Queue(
+            maxsize=batch_size * 4
+        )
+        pending_ids = iter(ids)
+
+        async def fetch_worker() -> None:
+            for animal_id in pending_ids:
+                detail = await fetch_detail(client, detail_url, animal_id, sem, breaker)
+                await queue.put(detail)
+
+        async def produce() -> None:
+            await asyncio.gather(*(fetch_worker() for _ in range(concurrency)))
+            await queue.put(None)
 
-        print(f"Posting to {home_url} in batches of {batch_size} …")
+        # Full batches are handed to a few POST workers so several are in flight
+        post_workers = max(1, min(8, concurrency // 4))
+        batches: asyncio.Queue[Optional[List[Dict[str, Any]]]] = asyncio.Queue(
+            maxsize=post_workers * 2
+        )
         sent = 0
-        for batch in chunks(details, batch_size):
-            resp = await post_json(client, home_url, batch)
-            sent += len(batch)
-            print(f"{sent}/{total} → {resp.get('message')}")
+
+        async def batch_items() -> None:
+            batch: List[Dict[str, Any]] = []
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                batch.append(item)
+                if len(batch) == batch_size:
+                    await batches.put(batch)
+                    batch = []
+            if batch:
+                await batches.put(batch)
+            for _ in range(post_workers):
+                await batches.put(None)
+
+        async def post_batches() -> None:
+            nonlocal sent
+            while True:
+                batch = await batches.get()
+                if batch is None:
+                    return
+                resp = await post_json(client, home_url, batch, breaker=breaker)
+                sent += len(batch)
+                print(f"{sent}/{total} → {resp.get('message')}")
+
+        await asyncio.gather(
+            produce(), batch_items(), *(post_batches() for _ in range(post_workers))
+        )
 
     print("✅ ETL complete")
 
@@ -203,4 +393,10 @@ def parse_args():
 
 if __name__ == "__main__":
     args = parse_args()
-    asyncio.run(run(args.base_url, args.concurrency, args.batch_size))
+    main = run(args.base_url, args.concurrency, args.batch_size)
+    try:
+        import uvloop
+    except ImportError:  # optional; not available on Windows
+        asyncio.run(main)
+    else:
+        uvloop.run(main)
@@ -2,13 +2,14 @@
 Unit tests for loader.py
 
 Covers:
-- pure helpers (chunks, to_iso8601_utc, transform)
+- pure helpers (backoff_delay, to_iso8601_utc, transform)
 - retry logic for GET/POST with httpx.MockTransport
 - end-to-end happy path using a mocked API (pagination -> details -> post)
 """
 
 import asyncio
 import json
+import time
 from datetime import datetime, timezone
 from typing import Any, Dict, List
 
@@ -16,7 +17,17 @@ import httpx
 import pytest
 
 # Import targets from loader.py
-from loader import chunks, to_iso8601_utc, transform, get_json, post_json, fetch_all_ids
+from loader import (
+    CircuitBreaker,
+    backoff_delay,
+    to_iso8601_utc,
+    transform,
+    get_json,
+    post_json,
+    fetch_all_ids,
+    fetch_bulk_ids,
+    run,
+)
 
 
 # ---------------------------
@@ -24,13 +35,6 @@ from loader import chunks, to_iso8601_utc, transform, get_json, post_json, fetch
 # ---------------------------
 
 
-def test_chunks_basic():
-    # chunks should split a list into fixed-size pieces
-    data = list(range(7))
-    out = list(chunks(data, 3))
-    assert out == [[0, 1, 2], [3, 4, 5], [6]]
-
-
 def test_to_iso8601_utc_numeric():
     # 1609459200000 = 2021-01-01T00:00:00Z
     iso = to_iso8601_utc(1609459200000)
@@ -38,12 +42,35 @@ def test_to_iso8601_utc_numeric():
     assert iso.endswith("Z")
 
 
+def test_to_iso8601_utc_matches_isoformat():
+    # exact output, including the millisecond fraction, pre-epoch values,
+    # years before 1000 (zero-padded) and float sub-millisecond precision
+    for ms in (
+        1609459200000,
+        1609459200123,
+        1,
+        -1500,
+        -60000000000000,
+        1609459200123.7,
+    ):
+        expected = (
+            datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+            .isoformat()
+            .replace("+00:00", "Z")
+        )
+        assert to_iso8601_utc(ms) == expected
+    assert to_iso8601_utc(1609459200123) == "2021-01-01T00:00:00.123000Z"
+    assert to_iso8601_utc(-60000000000000) == "0068-09-03T13:20:00Z"
+
+
 def test_to_iso8601_utc_string_and_invalid():
     # string numeric is okay
     iso = to_iso8601_utc("1609459200000")
     assert iso.startswith("2021-01-01T00:00:00")
     # non-numeric returns None
     assert to_iso8601_utc("abc") is None
+    # passes isdigit() but int() rejects it
+    assert to_iso8601_utc("²") is None
     # empty / None return None
     assert to_iso8601_utc("") is None
     assert to_iso8601_utc(None) is None
@@ -67,6 +94,17 @@ def test_transform_friends_and_born_at():
     assert transform(d3)["friends"] == []
 
 
+def test_backoff_delay_is_jittered_and_capped():
+    # first delay is drawn from [base, 3 * base]
+    first = [backoff_delay(None, base=1.0, cap=30.0) for _ in range(200)]
+    assert all(1.0 <= d <= 3.0 for d in first)
+    assert len(set(first)) > 1
+    # subsequent delays grow from the previous one but never exceed cap
+    assert all(
+        1.0 <= backoff_delay(25.0, base=1.0, cap=30.0) <= 30.0 for _ in range(200)
+    )
+
+
 # ---------------------------
 # Retry logic tests (GET/POST)
 # ---------------------------
@@ -117,6 +155,81 @@ async def test_post_json_retries_then_succeeds():
     assert attempts["n"] == 2
 
 
+@pytest.mark.asyncio
+async def test_get_json_honours_retry_after_on_429():
+    """
+    A 429 with Retry-After: 0 should be retried without falling back to the
+    jittered backoff.
+    """
+    attempts = {"n": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        attempts["n"] += 1
+        if attempts["n"] == 1:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        return httpx.Response(200, json={"ok": True})
+
+    transport = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        started = asyncio.get_running_loop().time()
+        data = await get_json(client, "http://test")
+        elapsed = asyncio.get_running_loop().time() - started
+    assert data == {"ok": True}
+    assert attempts["n"] == 2
+    assert elapsed < 0.5
+
+
+@pytest.mark.asyncio
+async def test_get_json_does_not_retry_client_errors():
+    """
+    A plain 404 is not transient: it must raise on the first attempt.
+    """
+    attempts = {"n": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        attempts["n"] += 1
+        return httpx.Response(404, text="nope")
+
+    transport = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        with pytest.raises(httpx.HTTPStatusError):
+            await get_json(client, "http://test")
+    assert attempts["n"] == 1
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_delays_requests():
+    """
+    While the breaker is open no request reaches the server; once it closes
+    the call goes through without having consumed a retry attempt.
+    """
+    loop = asyncio.get_running_loop()
+    breaker = CircuitBreaker()
+    breaker.open_until = time.monotonic() + 0.3
+    sent_at: List[float] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        sent_at.append(loop.time())
+        return httpx.Response(200, json={"ok": True})
+
+    transport = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        started = loop.time()
+        data = await get_json(client, "http://test", max_retries=1, breaker=breaker)
+    assert data == {"ok": True}
+    assert len(sent_at) == 1
+    assert sent_at[0] - started >= 0.3
+
+
+def test_circuit_trips_after_threshold_failures():
+    breaker = CircuitBreaker(threshold=3)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.open_until == 0.0
+    breaker.record_failure()
+    assert breaker.open_until > time.monotonic()
+
+
 # ---------------------------
 # End-to-end (mocked) flow tests
 # ---------------------------
@@ -146,6 +259,55 @@ async def test_fetch_all_ids_pagination():
         assert ids == [0, 1, 2, 3, 4, 5]
 
 
+@pytest.mark.asyncio
+async def test_fetch_all_ids_concurrent_pages_keep_order():
+    """
+    Later pages respond faster than earlier ones.
+    Verify pages 2..N are fetched concurrently and IDs stay in page order.
+    """
+    total_pages = 5
+    in_flight = {"now": 0, "max": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        page = int(httpx.QueryParams(request.url.query).get("page", "1"))
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep((total_pages - page) * 0.01)
+        in_flight["now"] -= 1
+        items = [{"id": page * 10}, {"id": page * 10 + 1}]
+        return httpx.Response(
+            200, json={"items": items, "page": page, "total_pages": total_pages}
+        )
+
+    transport = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        ids = await fetch_all_ids(
+            client, "http://test/animals/v1/animals", asyncio.Semaphore(4)
+        )
+
+    assert ids == [p * 10 + k for p in range(1, total_pages + 1) for k in (0, 1)]
+    assert in_flight["max"] > 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_bulk_ids_ndjson_and_fallback():
+    """
+    The NDJSON listing yields all IDs in one request; a 404 returns None so
+    the caller can fall back to pagination.
+    """
+    body = b'{"id":0,"name":"Cat"}\n{"id":1,"name":"Dog"}\n{"id":2,"name":"Owl"}'
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "bulk":
+            return httpx.Response(200, content=body)
+        return httpx.Response(404)
+
+    transport = httpx.MockTransport(handler)
+    async with httpx.AsyncClient(transport=transport) as client:
+        assert await fetch_bulk_ids(client, "http://bulk/animals.ndjson") == [0, 1, 2]
+        assert await fetch_bulk_ids(client, "http://none/animals.ndjson") is None
+
+
 @pytest.mark.asyncio
 async def test_full_flow_mocked_details_and_post():
     """
@@ -183,6 +345,9 @@ async def test_full_flow_mocked_details_and_post():
 
     async def handler(request: httpx.Request) -> httpx.Response:
         url = str(request.url)
+        if request.url.path.endswith(".ndjson"):
+            # No bulk endpoint: the loader must fall back to pagination
+            return httpx.Response(404)
         if "/animals/v1/animals" in url and request.method == "GET":
             # Listing vs details?
             if request.url.path.endswith("/animals"):
@@ -201,35 +366,9 @@ async def test_full_flow_mocked_details_and_post():
 
         return httpx.Response(404)
 
+    # Drive the real pipeline through one client; concurrency=1 keeps order
     transport = httpx.MockTransport(handler)
-    async with httpx.AsyncClient(transport=transport) as client:
-        # Reuse fetch_all_ids + get_json for details + emulate transform+post
-        ids = await fetch_all_ids(client, "http://x/animals/v1/animals")
-
-        # Transform each detail and batch post
-        transformed = []
-        for _id in ids:
-            r = await httpx.AsyncClient(
-                transport=transport
-            ).__aenter__()  # create ephemeral client for detail
-            try:
-                detail = (await r.get(f"http://x/animals/v1/animals/{_id}")).json()
-            finally:
-                await r.aclose()
-
-            t = transform(detail)
-            transformed.append(t)
-
-        # Post them in batches of 2
-        for i in range(0, len(transformed), 2):
-            batch = transformed[i : i + 2]
-            # Use post_json to exercise retry wrapper as well (here 200 immediate)
-            resp = await post_json(
-                httpx.AsyncClient(transport=transport),
-                "http://x/animals/v1/home",
-                batch,
-            )
-            assert "Helped" in resp["message"]
+    await run("http://x", concurrency=1, batch_size=2, transport=transport)
 
     # Validate the batches we "posted" were transformed correctly
     assert len(posted_batches) == 2  # 3 items with batch size 2 → 2 POSTs
@@ -243,3 +382,85 @@ async def test_full_flow_mocked_details_and_post():
     b1 = posted_batches[1]
     assert b1[0]["friends"] == ["Cat"]
     assert b1[0]["born_at"].startswith("2021-01-01T00:00:00")
+
+
+@pytest.mark.asyncio
+async def test_run_posts_batches_concurrently_exactly_once():
+    """
+    With concurrency=8 the pipeline runs two POST workers: batches must
+    overlap in flight and every animal must be posted exactly once.
+    """
+    total = 40
+    posted_ids: List[int] = []
+    in_flight = {"now": 0, "max": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.endswith(".ndjson"):
+            return httpx.Response(404)
+        if request.method == "GET" and path.endswith("/animals"):
+            items = [{"id": i} for i in range(total)]
+            return httpx.Response(
+                200, json={"items": items, "page": 1, "total_pages": 1}
+            )
+        if request.method == "GET":
+            animal_id = int(path.split("/")[-1])
+            return httpx.Response(
+                200, json={"id": animal_id, "name": "Cat", "friends": "Dog"}
+            )
+
+        body = json.loads((await request.aread()).decode())
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.05)
+        in_flight["now"] -= 1
+        posted_ids.extend(item["id"] for item in body)
+        return httpx.Response(200, json={"message": f"Helped {len(body)} find home"})
+
+    transport = httpx.MockTransport(handler)
+    await run("http://x", concurrency=8, batch_size=5, transport=transport)
+
+    assert sorted(posted_ids) == list(range(total))
+    assert in_flight["max"] >= 2
+
+
+@pytest.mark.asyncio
+async def test_run_bounds_fetched_but_unposted_records():
+    """
+    With fast GETs and slow POSTs the full queues must throttle detail
+    fetching instead of letting finished records pile up.
+    """
+    total = 400
+    concurrency, batch_size = 8, 5
+    post_workers = 2  # min(8, concurrency // 4)
+    counts = {"fetched": 0, "posted": 0, "max_pending": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.endswith(".ndjson"):
+            return httpx.Response(404)
+        if request.method == "GET" and path.endswith("/animals"):
+            items = [{"id": i} for i in range(total)]
+            return httpx.Response(
+                200, json={"items": items, "page": 1, "total_pages": 1}
+            )
+        if request.method == "GET":
+            counts["fetched"] += 1
+            pending = counts["fetched"] - counts["posted"]
+            counts["max_pending"] = max(counts["max_pending"], pending)
+            animal_id = int(path.split("/")[-1])
+            return httpx.Response(200, json={"id": animal_id, "name": "Cat"})
+
+        body = json.loads((await request.aread()).decode())
+        counts["posted"] += len(body)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"message": f"Helped {len(body)} find home"})
+
+    transport = httpx.MockTransport(handler)
+    await run("http://x", concurrency, batch_size, transport=transport)
+
+    # item queue + one record per fetch worker + the batch being filled
+    # + the batch queue
+    bound = batch_size * 4 + concurrency + batch_size + post_workers * 2 * batch_size
+    assert counts["posted"] == total
+    assert counts["max_pending"] <= bound
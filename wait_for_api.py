@@ -1,29 +1,54 @@
 # wait_for_api.py
+import http.client
 import os
+import random
 import sys
 import time
-from urllib.request import urlopen
-from urllib.error import URLError, HTTPError
+from urllib.parse import urlsplit
 
 URL = os.environ.get("WAIT_URL", "http://api:3123/")
 TIMEOUT_SECONDS = int(os.environ.get("WAIT_TIMEOUT", "180"))  # default 3 min
+PROBE_TIMEOUT = 1.0  # per-attempt socket timeout (connect and read)
 
 print(f"Waiting for API at {URL} (timeout {TIMEOUT_SECONDS}s)...", flush=True)
 deadline = time.time() + TIMEOUT_SECONDS
 
+parts = urlsplit(URL)
+conn_cls = (
+    http.client.HTTPSConnection
+    if parts.scheme == "https"
+    else http.client.HTTPConnection
+)
+path = parts.path or "/"
+if parts.query:
+    path += f"?{parts.query}"
+
+# HEAD skips the body; fall back to GET if the server doesn't implement it
+method = "HEAD"
+conn = None
 attempt = 0
 while time.time() < deadline:
     attempt += 1
     try:
-        with urlopen(URL, timeout=3) as r:
-            code = getattr(r, "status", 200)  # py311 returns .status
-            if 200 <= code < 400:
-                print(f"API is up! HTTP {code}", flush=True)
-                sys.exit(0)
-    except (URLError, HTTPError) as e:
-        # e.code for HTTPError, e.reason for URLError
-        pass
-    time.sleep(1)
+        if conn is None:
+            conn = conn_cls(parts.hostname, parts.port, timeout=PROBE_TIMEOUT)
+        conn.request(method, path)
+        r = conn.getresponse()
+        r.read()  # drain so the connection can be reused
+        code = r.status
+        if method == "HEAD" and code in (405, 501):
+            method = "GET"
+            continue
+        if 200 <= code < 400:
+            print(f"API is up! HTTP {code}", flush=True)
+            sys.exit(0)
+    except (OSError, http.client.HTTPException):
+        # Drop the broken socket; a fresh one is opened on the next attempt
+        if conn is not None:
+            conn.close()
+            conn = None
+    # Short jittered sleep so several waiters don't probe in lockstep
+    time.sleep(0.2 + random.random() * 0.3)
 
 print("API not ready in time.", flush=True)
 sys.exit(1)